@@ -1,12 +1,10 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
 import time
 import threading
 import serial
 import serial.tools.list_ports
-from collections import deque
-import random
+from array import array
 
 # ===============================
 # CONFIGURATION
@@ -16,6 +14,11 @@ SAMPLE_INTERVAL = 0.25 # seconds
 SMOOTH_WINDOW = 8 # samples (~2 sec)
 THRESH_HIGH = 70
 THRESH_MED = 40
+HISTORY_LEN = 400 # samples kept for the chart
+NOISE_LEN = 4096 # demo noise table size (power of two)
+# Indexed by level: 0 = green, 1 = yellow, 2 = red (the level sent to the Arduino)
+STATUS_STYLES = ("success", "warning", "error")
+STATUS_MESSAGES = ("🟢 Relaxed (Green)", "🟡 Mild (Yellow)", "🔴 High Stress (Red)")
 
 # ===============================
 # HELPER FUNCTIONS
@@ -27,6 +30,16 @@ def find_arduino_port():
             return p.device
     return None
 
+def build_level_lut(th_med, th_high):
+    # Stress level for every value 0..100
+    lut = np.full(101, 2, dtype=np.uint8)
+    lut[th_med:] = 1
+    lut[th_high:] = 0
+    return lut
+
+def generate_demo_data(noise, i):
+    return int(max(0, min(100, 60 + 8 * noise[i & (NOISE_LEN - 1)])))
+
 # ===============================
 # SERIAL COMMUNICATION CLASSES
 # ===============================
@@ -43,25 +56,40 @@ class SerialReader(threading.Thread):
     def connect(self):
         try:
             self.ser = serial.Serial(self.port, self.baud, timeout=1)
+            # Lower the USB-serial latency timer (Linux) / enlarge the RX buffer (Windows)
+            try:
+                self.ser.set_low_latency_mode(True)
+            except Exception:
+                pass
+            try:
+                self.ser.set_buffer_size(rx_size=4096)
+            except Exception:
+                pass
             time.sleep(1)
         except Exception:
             self.ser = None
 
     def run(self):
+        pending = b""
         while not self._stop:
             if self.ser is None:
+                pending = b""
                 self.connect()
                 time.sleep(1)
                 continue
             try:
-                line = self.ser.readline().decode(errors='ignore').strip()
-                if line.startswith("PULSE_RAW:"):
-                    try:
-                        raw = int(line.split(":")[1])
-                        scaled = int(100.0 * (raw / 1023.0))
-                        self.out_list.append(scaled)
-                    except:
-                        pass
+                # Read whatever has arrived in one call and split it into lines
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if line.startswith(b"PULSE_RAW:"):
+                        try:
+                            raw = int(line[10:])
+                            scaled = max(0, min(100, (raw * 100) // 1023))
+                            self.out_list.append(scaled)
+                        except:
+                            pass
             except Exception:
                 try:
                     self.ser.close()
@@ -77,6 +105,35 @@ class SerialReader(threading.Thread):
     def stop(self):
         self._stop = True
 
+# Lock-free single-producer/single-consumer ring of byte samples (0-255).
+# The reader thread only moves head and the UI only moves tail, so plain
+# attribute writes under the GIL are enough; when full, new samples are dropped.
+class ByteRing:
+    def __init__(self, size):
+        self.size = size
+        self.buf = array('B', bytes(size))
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
+
+    def append(self, value):
+        nxt = (self.head + 1) % self.size
+        if nxt == self.tail:
+            return
+        self.buf[self.head] = value
+        self.head = nxt
+
+    def drain(self):
+        head = self.head
+        if head >= self.tail:
+            out = self.buf[self.tail:head]
+        else:
+            out = self.buf[self.tail:] + self.buf[:head]
+        self.tail = head
+        return out
+
 class ArduinoWriter:
     def __init__(self, port, baud):
         self.port = port
@@ -104,24 +161,32 @@ class ArduinoWriter:
 st.set_page_config(layout="wide", page_title="NeuroFocus")
 st.title("🧠 NeuroFocus — Attention / Stress Monitor")
 
-# Sidebar Settings
+# Sidebar Settings (snapshotted into st.session_state.cfg for the monitoring fragment)
+def update_cfg():
+    st.session_state.cfg = {
+        "demo_mode": st.session_state.demo_mode,
+        "sample_interval": st.session_state.sample_interval,
+        "smooth_w": st.session_state.smooth_w,
+        "th_high": st.session_state.th_high,
+        "th_med": st.session_state.th_med,
+    }
+    st.session_state.level_lut = build_level_lut(st.session_state.th_med, st.session_state.th_high)
+
 with st.sidebar:
     st.subheader("⚙️ Settings")
-    demo_mode = st.checkbox("Use Demo Mode (no hardware)", value=True)
-    sample_interval = st.number_input("Sample interval (s)", value=SAMPLE_INTERVAL, min_value=0.1, step=0.1)
-    smooth_w = st.slider("Smoothing window (samples)", 1, 30, SMOOTH_WINDOW)
-    th_high = st.slider("Green threshold (≥)", 50, 100, THRESH_HIGH)
-    th_med = st.slider("Yellow threshold (< and ≥)", 0, 99, THRESH_MED)
+    demo_mode = st.checkbox("Use Demo Mode (no hardware)", value=True, key="demo_mode", on_change=update_cfg)
+    sample_interval = st.number_input("Sample interval (s)", value=SAMPLE_INTERVAL, min_value=0.1, step=0.1, key="sample_interval", on_change=update_cfg)
+    smooth_w = st.slider("Smoothing window (samples)", 1, 30, SMOOTH_WINDOW, key="smooth_w", on_change=update_cfg)
+    th_high = st.slider("Green threshold (≥)", 50, 100, THRESH_HIGH, key="th_high", on_change=update_cfg)
+    th_med = st.slider("Yellow threshold (< and ≥)", 0, 99, THRESH_MED, key="th_med", on_change=update_cfg)
     st.write("Green ≥", th_high)
     st.write("Yellow ≥", th_med, "and <", th_high)
     st.write("Red <", th_med)
+if "cfg" not in st.session_state:
+    update_cfg()
 
 # Main layout
 col1, col2 = st.columns([3, 1])
-with col1:
-    chart_placeholder = st.empty()
-    metric_placeholder = st.empty()
-    status_placeholder = st.empty()
 with col2:
     st.write("### Controls")
     if "running" not in st.session_state:
@@ -131,14 +196,24 @@ with col2:
     stop = st.button("⏹️ Stop Monitoring", disabled=not st.session_state.running)
 
     arduino_port_input = st.text_input("Arduino port (leave blank to auto-find)")
-    detected_port = arduino_port_input or find_arduino_port()
+    rescan = st.button("🔄 Rescan Ports")
+    if rescan or "detected_port" not in st.session_state:
+        st.session_state.detected_port = find_arduino_port()
+    detected_port = arduino_port_input or st.session_state.detected_port
     st.write("Detected port:", detected_port or "None")
 
 # Initialize buffers
-if "values" not in st.session_state:
-    st.session_state.values = deque(maxlen=400)
+if "buf" not in st.session_state:
+    st.session_state.buf = np.zeros(HISTORY_LEN, dtype=np.int16)
+    st.session_state.widx = 0
+    st.session_state.count = 0
+if "noise" not in st.session_state:
+    st.session_state.noise = np.random.standard_normal(NOISE_LEN).astype(np.float32)
+    st.session_state.nidx = 0
+if "ema" not in st.session_state:
+    st.session_state.ema = None
 if "serial_queue" not in st.session_state:
-    st.session_state.serial_queue = []
+    st.session_state.serial_queue = ByteRing(1024)
 if "reader" not in st.session_state:
     st.session_state.reader = None
 if "writer" not in st.session_state:
@@ -148,7 +223,11 @@ if "writer" not in st.session_state:
 # START BUTTON
 # ===============================
 if start:
-    st.session_state.values.clear()
+    st.session_state.widx = 0
+    st.session_state.count = 0
+    st.session_state.noise = np.random.standard_normal(NOISE_LEN).astype(np.float32)
+    st.session_state.nidx = 0
+    st.session_state.ema = None
     st.session_state.running = True
 
     # Setup hardware
@@ -164,7 +243,7 @@ if start:
             st.session_state.reader = reader
             st.session_state.writer = ArduinoWriter(port, ARDUINO_BAUD)
 
-    st.experimental_rerun()
+    st.rerun()
 
 # ===============================
 # STOP BUTTON
@@ -175,48 +254,68 @@ if stop:
         st.session_state.reader.stop()
         st.session_state.reader = None
     st.success("🛑 Monitoring stopped.")
-    st.experimental_rerun()
+    st.rerun()
 
 # ===============================
 # MONITORING LOOP
 # ===============================
-if st.session_state.running:
-    # Simulate or read data
-    if demo_mode:
-        val = int(max(0, min(100, random.gauss(60, 8))))
-    else:
-        q = st.session_state.serial_queue
-        if q:
-            val = q.pop(0)
-        else:
-            val = int(max(0, min(100, random.gauss(60, 8))))
-
-    st.session_state.values.append(val)
-
-    # Smooth data
-    window = list(st.session_state.values)[-smooth_w:]
-    smooth = int(np.mean(window)) if window else val
-
-    # Update visuals
-    data = pd.DataFrame({"value": list(st.session_state.values)})
-    chart_placeholder.line_chart(data)
-    metric_placeholder.metric("Current Value", smooth)
-
-    # Determine stress level
-    if smooth >= th_high:
-        level = 0
-        status_placeholder.success("🟢 Relaxed (Green)")
-    elif smooth >= th_med:
-        level = 1
-        status_placeholder.warning("🟡 Mild (Yellow)")
+# Only this fragment reruns every sample interval; the rest of the page stays mounted
+@st.fragment(run_every=sample_interval if st.session_state.running else None)
+def monitor():
+    if not st.session_state.running:
+        return
+    cfg = st.session_state.cfg
+
+    # Simulate or read data (drain everything queued since the last tick)
+    batch = st.session_state.serial_queue.drain() if not cfg["demo_mode"] else []
+    if not batch:
+        batch.append(generate_demo_data(st.session_state.noise, st.session_state.nidx))
+        st.session_state.nidx += 1
+
+    # Append to the ring buffer; widx is the next write slot
+    buf = st.session_state.buf
+    tail = batch[-HISTORY_LEN:]
+    start_idx = st.session_state.widx + len(batch) - len(tail)
+    buf[(start_idx + np.arange(len(tail))) % HISTORY_LEN] = tail
+    st.session_state.widx = (st.session_state.widx + len(batch)) % HISTORY_LEN
+    st.session_state.count = min(st.session_state.count + len(batch), HISTORY_LEN)
+    widx = st.session_state.widx
+    count = st.session_state.count
+    if count == HISTORY_LEN:
+        older, newer = buf[widx:], buf[:widx]
     else:
-        level = 2
-        status_placeholder.error("🔴 High Stress (Red)")
+        older, newer = buf[:count], buf[:0]
+
+    # Smooth data (EMA with the same span as a smooth_w-sample SMA)
+    alpha = 2.0 / (cfg["smooth_w"] + 1)
+    ema = st.session_state.ema
+    for val in batch:
+        ema = val if ema is None else (1 - alpha) * ema + alpha * val
+    st.session_state.ema = ema
+    smooth = int(ema)
+
+    # Chart series (cumsum SMA over the whole history, read straight from the two ring halves)
+    w = min(cfg["smooth_w"], count)
+    split = len(older) + 1
+    csum = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(older, dtype=np.int32, out=csum[1:split])
+    np.cumsum(newer, dtype=np.int32, out=csum[split:])
+    csum[split:] += csum[split - 1]
+    sma = (csum[w:] - csum[:-w]) * (1.0 / w)
+
+    # Determine stress level (whole chart window for history, smoothed value for status)
+    lut = st.session_state.level_lut
+    st.session_state.levels = lut[sma.astype(np.intp)]
+    level = int(lut[smooth])
+
+    # Draw straight into the fragment; each rerun updates these elements in place
+    st.line_chart(sma)
+    st.metric("Current Value", smooth)
+    getattr(st, STATUS_STYLES[level])(STATUS_MESSAGES[level])
 
     # Send to Arduino
     if st.session_state.writer is not None:
         st.session_state.writer.send(f"SET:{level}")
 
-    # Wait and rerun
-    time.sleep(sample_interval)
-    st.experimental_rerun()
+with col1:
+    monitor()